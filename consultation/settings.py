@@ -132,6 +132,11 @@ STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media/'
+# None streams files from django (sendfile(2) when the server provides wsgi.file_wrapper),
+# 'nginx' answers with X-Accel-Redirect to MEDIA_ACCEL_PREFIX, 'apache' with X-Sendfile
+MEDIA_SENDFILE_BACKEND = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
@@ -139,6 +144,16 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'med.User'
 
+# the statistics rollups are kept by `manage.py rollup_stats`, run every minute or so;
+# rows younger than ANALYTICS_ROLLUP_SAFETY_LAG (seconds) are not folded yet, their
+# transaction or one holding a lower id may still be open
+ANALYTICS_ROLLUP_SAFETY_LAG = 60
+# also fold up to rollups.ON_WRITE_BATCH_SIZE settled rows per source after each commit
+# that creates a consultation, message or review. This never includes the new row (it is
+# younger than the lag), so the rollups stay at least that stale either way; it only
+# spreads the backlog between runs at the cost of a few queries per write
+ANALYTICS_ROLLUP_ON_WRITE = False
+
 #rest_framework
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
@@ -151,7 +166,7 @@ REST_FRAMEWORK = {
     ),
 
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'drf.authentication.JWTAuthentication',
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.BasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
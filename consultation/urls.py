@@ -16,11 +16,15 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include, re_path
+from drf.authentication import jwt_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('drf.urls')),
     path('api/v1/auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
-    path('auth/', include('djoser.urls.jwt')),
+    # djoser.urls.jwt with views that import simplejwt on first use
+    re_path(r'^auth/jwt/create/?', jwt_view('TokenObtainPairView'), name='jwt-create'),
+    re_path(r'^auth/jwt/refresh/?', jwt_view('TokenRefreshView'), name='jwt-refresh'),
+    re_path(r'^auth/jwt/verify/?', jwt_view('TokenVerifyView'), name='jwt-verify'),
 ]
@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+
+class JWTAuthentication(BaseAuthentication):
+    """
+    Stand-in for rest_framework_simplejwt's JWTAuthentication that only imports
+    simplejwt (token models, PyJWT, cryptography) once a request actually
+    carries a token, so processes that never see one don't pay for it.
+    """
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        header_types = {header_type.lower().encode() for header_type in settings.SIMPLE_JWT['AUTH_HEADER_TYPES']}
+        if not header or header[0].lower() not in header_types:
+            return None
+
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        return JWTAuthentication().authenticate(request)
+
+    def authenticate_header(self, request):
+        return '%s realm="api"' % settings.SIMPLE_JWT['AUTH_HEADER_TYPES'][0]
+
+
+def jwt_view(name):
+    """
+    View for simplejwt's ``name`` view class that imports simplejwt on the
+    first request instead of when the URLconf loads.
+    """
+    view = None
+
+    @csrf_exempt
+    def lazy_view(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string('rest_framework_simplejwt.views.' + name).as_view()
+        return view(request, *args, **kwargs)
+
+    return lazy_view
@@ -0,0 +1,157 @@
+import json
+import os
+import zipfile
+
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.html import escape
+from med.models import ConsultationMessage
+
+# rows fetched per round trip from the server-side cursor
+CHUNK_SIZE = 500
+COPY_BUFFER_SIZE = 64 * 1024
+
+
+class ZipStream:
+    """
+    Write-only, unseekable file for ZipFile. Whatever the archive writes is
+    kept until the generator takes it with pop(), so only the current chunk
+    is ever held in memory.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def messages(consultation):
+    return (
+        ConsultationMessage.objects
+        .filter(consultation=consultation)
+        .select_related('from_user')
+        .order_by('id')
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def attachment_path(message, name):
+    return 'attachments/%d/%s' % (message.id, os.path.basename(name))
+
+
+def message_data(message):
+    return {
+        'id': message.id,
+        'from_user': {'id': message.from_user_id, 'username': message.from_user.username},
+        'date_created': message.date_created,
+        'message': message.message,
+        'attachments': [attachment_path(message, name) for name in message.attachments],
+    }
+
+
+def consultation_data(consultation):
+    doctor = consultation.from_doctor
+    return {
+        'id': consultation.id,
+        'date_created': consultation.date_created,
+        'doctor': {'id': doctor.id, 'name': ' '.join(filter(None, (doctor.last_name, doctor.first_name, doctor.surname)))},
+        'patient': {'id': consultation.to_user_id, 'username': consultation.to_user.username},
+    }
+
+
+def transcript_json(consultation):
+    header = json.dumps(consultation_data(consultation), cls=DjangoJSONEncoder)
+    yield ('{"consultation": %s, "messages": [' % header).encode()
+    separator = ''
+    for message in messages(consultation):
+        yield (separator + json.dumps(message_data(message), cls=DjangoJSONEncoder)).encode()
+        separator = ', '
+    yield b']}\n'
+
+
+def transcript_html(consultation):
+    data = consultation_data(consultation)
+    yield (
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>Consultation %d</title></head><body>\n'
+        '<h1>Consultation %d</h1>\n<p>%s &mdash; %s, %s</p>\n'
+        % (
+            consultation.id, consultation.id, escape(data['doctor']['name']), escape(data['patient']['username']),
+            timezone.localtime(consultation.date_created).strftime('%Y-%m-%d %H:%M'),
+        )
+    ).encode()
+    for message in messages(consultation):
+        links = ''.join(
+            '<li><a href="%s">%s</a></li>' % (escape(path), escape(os.path.basename(path)))
+            for path in message_data(message)['attachments']
+        )
+        yield (
+            '<div class="message"><p><b>%s</b> <time>%s</time></p><p>%s</p>%s</div>\n'
+            % (
+                escape(message.from_user.username),
+                timezone.localtime(message.date_created).strftime('%Y-%m-%d %H:%M'),
+                escape(message.message).replace('\n', '<br>'),
+                '<ul>%s</ul>' % links if links else '',
+            )
+        ).encode()
+    yield b'</body></html>\n'
+
+
+def transcript_zip(consultation):
+    """
+    Yield a ZIP archive with transcript.json, transcript.html and the message
+    attachments, piece by piece. Messages are read through a server-side
+    cursor, so memory doesn't depend on the length of the consultation.
+    """
+    return (chunk for chunk in _zip_parts(consultation) if chunk)
+
+
+def _zip_parts(consultation):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, parts in (('transcript.json', transcript_json), ('transcript.html', transcript_html)):
+            with archive.open(name, 'w', force_zip64=True) as entry:
+                for part in parts(consultation):
+                    entry.write(part)
+                    yield stream.pop()
+
+        with_attachments = (
+            ConsultationMessage.objects
+            .filter(consultation=consultation)
+            .exclude(attachments=[])
+            .only('id', 'attachments', 'date_created')
+            .order_by('id')
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        for message in with_attachments:
+            for name in message.attachments:
+                try:
+                    source = default_storage.open(name, 'rb')
+                except OSError:
+                    continue
+                info = zipfile.ZipInfo(
+                    attachment_path(message, name),
+                    date_time=timezone.localtime(message.date_created).timetuple()[:6],
+                )
+                # images are already compressed
+                info.compress_type = zipfile.ZIP_STORED
+                with source, archive.open(info, 'w', force_zip64=True) as entry:
+                    for chunk in iter(lambda: source.read(COPY_BUFFER_SIZE), b''):
+                        entry.write(chunk)
+                        yield stream.pop()
+    yield stream.pop()
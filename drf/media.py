@@ -0,0 +1,156 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from med.models import ConsultationMessage
+from .permissions import consultation_participant_q, is_admin
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def public(request, name):
+    return True
+
+
+def attachment_visible(request, name):
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    messages = ConsultationMessage.objects.filter(attachments__contains=[name])
+    if not is_admin(user):
+        messages = messages.filter(consultation_participant_q(user, 'consultation__'))
+    return messages.exists()
+
+
+# upload directory -> (access check, cache privately)
+ACCESS_RULES = {
+    'users': (public, False),
+    'message_images': (attachment_visible, True),
+}
+
+
+class RangeFile:
+    """
+    Read-only window of ``length`` bytes starting at ``start``.
+
+    Keeps ``fileno`` so that wsgi.file_wrapper implementations (gunicorn,
+    uwsgi) still send the range with sendfile(2) from the current offset.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Return an inclusive (start, end) pair for a single byte range, or None
+    to serve the whole file. Raises ValueError when the range can't be
+    satisfied.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        if int(last) == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range outside of file')
+    return start, end
+
+
+def delegated_response(path, full_path, content_type):
+    backend = getattr(settings, 'MEDIA_SENDFILE_BACKEND', None)
+    response = HttpResponse(content_type=content_type)
+    if backend == 'nginx':
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + quote(path)
+    elif backend == 'apache':
+        response['X-Sendfile'] = quote(full_path)
+    else:
+        raise ImproperlyConfigured('Unknown MEDIA_SENDFILE_BACKEND %r' % backend)
+    return response
+
+
+def file_response(request, full_path, size, etag, content_type):
+    byte_range = None
+    header = request.headers.get('Range')
+    if header and request.method == 'GET' and request.headers.get('If-Range', etag) == etag:
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(RangeFile(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, path):
+    # The rule is chosen by the first segment, so the path must already be in
+    # its final form: 'users/../message_images/x' would otherwise pass as public.
+    segments = path.split('/')
+    if any(segment in ('', '.', '..') or '\\' in segment for segment in segments):
+        raise Http404
+    rule = ACCESS_RULES.get(segments[0])
+    if rule is None:
+        raise Http404
+    check, private = rule
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(st.st_mode) or not check(request, path):
+        raise Http404
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if getattr(settings, 'MEDIA_SENDFILE_BACKEND', None):
+        response = delegated_response(path, full_path, content_type)
+    else:
+        etag = quote_etag('%x-%x' % (st.st_mtime_ns, st.st_size))
+        response = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+        if response is None:
+            response = file_response(request, full_path, st.st_size, etag, content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(st.st_mtime)
+
+    patch_cache_control(response, max_age=settings.MEDIA_CACHE_MAX_AGE, **{'private' if private else 'public': True})
+    return response
@@ -0,0 +1,32 @@
+from django.db.models import Q
+from rest_framework.permissions import BasePermission
+from med.models import Doctor, UserRoles
+
+
+def is_admin(user):
+    return user.is_authenticated and (user.is_staff or user.role == UserRoles.SUPERUSER)
+
+
+def consultation_participant_q(user, prefix=''):
+    # doctor ids are resolved up front so the OR stays on two indexed columns
+    # of the consultation table instead of spanning a join
+    doctors = list(Doctor.objects.filter(user=user).values_list('pk', flat=True))
+    return Q(**{prefix + 'to_user': user}) | Q(**{prefix + 'from_doctor__in': doctors})
+
+
+def is_consultation_participant(user, consultation):
+    if not user.is_authenticated:
+        return False
+    if is_admin(user):
+        return True
+    return consultation.to_user_id == user.id or consultation.from_doctor.user_id == user.id
+
+
+class IsConsultationParticipant(BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return is_consultation_participant(request.user, obj)
+
+
+class IsAdmin(BasePermission):
+    def has_permission(self, request, view):
+        return is_admin(request.user)
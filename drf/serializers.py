@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from med.models import *
+from med.models import Consultation, ConsultationMessage, ConsultationStats, Doctor, DoctorDailyStats, Review, Speciality
 from djoser.serializers import UserCreateSerializer
 from django.contrib.auth import get_user_model
 
@@ -40,6 +40,28 @@ class SpeicalitySerializer(serializers.ModelSerializer):
         fields = ('id', 'name')
 
 
+class SpecialityDirectorySerializer(SpeicalitySerializer):
+    # specialities created since the last view refresh have no stats row yet
+    doctors_count = serializers.SerializerMethodField()
+    reviews_count = serializers.SerializerMethodField()
+    average_rating = serializers.SerializerMethodField()
+
+    class Meta(SpeicalitySerializer.Meta):
+        fields = SpeicalitySerializer.Meta.fields + ('doctors_count', 'reviews_count', 'average_rating')
+
+    def get_doctors_count(self, obj):
+        stats = getattr(obj, 'stats', None)
+        return stats.doctors_count if stats else 0
+
+    def get_reviews_count(self, obj):
+        stats = getattr(obj, 'stats', None)
+        return stats.reviews_count if stats else 0
+
+    def get_average_rating(self, obj):
+        stats = getattr(obj, 'stats', None)
+        return stats.average_rating if stats else None
+
+
 class DoctorSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     speciality = SpeicalitySerializer()
@@ -100,3 +122,15 @@ class ReviewSerializer(serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ('id', 'from_user', 'to_doctor', 'rate', 'message', 'consultation')
+
+
+class DoctorDailyStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DoctorDailyStats
+        fields = ('day', 'consultations', 'messages', 'reviews', 'average_rating')
+
+
+class ConsultationStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ConsultationStats
+        fields = ('consultation', 'messages', 'last_message_at')
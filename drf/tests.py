@@ -1,3 +1,353 @@
-from django.test import TestCase
+import json
+import os
+import re
+from datetime import timedelta
+from urllib.parse import quote, urlencode
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from med import speciality_stats
+from med.models import (
+    Consultation,
+    ConsultationMessage,
+    ConsultationStats,
+    Doctor,
+    DoctorDailyStats,
+    Review,
+    Speciality,
+    User,
+)
+from med.testing import ConsultationTestData, TempMediaRootMixin, create_user
+from . import urls
+
+# Tables that grow with usage. A sequential scan over one of them means a
+# missing index, unless the endpoint intentionally returns the whole table.
+LARGE_TABLES = {
+    'med_user',
+    'med_doctor',
+    'med_consultation',
+    'med_consultationmessage',
+    'med_review',
+    'med_doctordailystats',
+    'med_consultationstats',
+}
+
+ATTACHMENT = 'message_images/scan.png'
+
+# Not counted against a budget: the test case wraps requests in savepoints.
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE', 'ROLLBACK', 'BEGIN', 'COMMIT')
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# QuerySet.iterator() reads through a server-side cursor
+DECLARE_RE = re.compile(r'^DECLARE\s+("[^"]*"|\S+)\s+[\w\s]*?CURSOR(\s+WITH(OUT)?\s+HOLD)?\s+FOR\s+', re.I)
+
+# Every named route in drf/urls.py needs an entry: who calls it, how, and the
+# maximum number of queries it may run, including on-commit callbacks.
+# `seq_scans` lists the large tables the endpoint is allowed to scan,
+# `settings` overrides settings for the call.
+ENDPOINTS = {
+    'profile': {'user': 'patient', 'queries': 0},
+    'get_me': {'user': 'patient', 'queries': 0},
+    'speciality_list': {'queries': 1},
+    'speciality_detail': {'kwargs': lambda seed: {'pk': seed['speciality'].pk}, 'queries': 1},
+    'doctors_list': {'queries': 1, 'seq_scans': {'med_doctor', 'med_user'}},
+    'doctors_detail': {'kwargs': lambda seed: {'pk': seed['doctor'].pk}, 'queries': 1},
+    'review_list_create': {
+        'user': 'patient',
+        'method': 'post',
+        'kwargs': lambda seed: {'consultation_id': seed['consultation'].pk},
+        'data': lambda seed: {
+            'from_user': seed['patient'].pk,
+            'to_doctor': seed['doctor'].pk,
+            'rate': 5,
+            'message': 'Thanks',
+        },
+        # 4 for the request, 15 for the optional on-write rollup fold merging a batch
+        # into existing rollup rows: the watermark lock, then per source the batch,
+        # the rollup rows, their update and the watermark (plus consultation stats for
+        # messages); rollup rows for new doctor days would add an INSERT per source
+        'settings': {'ANALYTICS_ROLLUP_ON_WRITE': True, 'ANALYTICS_ROLLUP_SAFETY_LAG': 0},
+        'queries': 19,
+    },
+    'consultation_export': {
+        'user': 'patient',
+        'kwargs': lambda seed: {'pk': seed['consultation'].pk},
+        'queries': 4,
+    },
+    'stats_overview': {'user': 'admin', 'query': {'date_from': 'recent'}, 'queries': 1},
+    'doctor_stats': {'user': 'doctor', 'kwargs': lambda seed: {'pk': seed['doctor'].pk}, 'queries': 2},
+    'consultation_stats': {'user': 'patient', 'queries': 2},
+    'media': {'user': 'patient', 'kwargs': lambda seed: {'path': ATTACHMENT}, 'queries': 2},
+}
+
+
+def seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+@override_settings(MEDIA_SENDFILE_BACKEND=None)
+class QueryPlanTests(TempMediaRootMixin, TestCase):
+    """
+    Calls every route with seeded data, EXPLAINs each statement it runs
+    (including the queries behind server-side cursors) and fails on
+    sequential scans over large tables or on statement counts over budget.
+    Needs PostgreSQL, like the models themselves.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        default_storage.save(ATTACHMENT, ContentFile(b'\x89PNG'))
+
+    @classmethod
+    def setUpTestData(cls):
+        specialities = Speciality.objects.bulk_create([Speciality(name='Speciality %d' % i) for i in range(20)])
+        users = User.objects.bulk_create([
+            User(username='user%d' % i, email='user%d@example.com' % i, password='!')
+            for i in range(2000)
+        ])
+        doctors = Doctor.objects.bulk_create([
+            Doctor(
+                first_name='Doctor', last_name=str(i), surname='', description='',
+                user=users[i], speciality=specialities[i % len(specialities)],
+            )
+            for i in range(500)
+        ])
+        consultations = Consultation.objects.bulk_create([
+            Consultation(from_doctor=doctors[i % len(doctors)], to_user=users[500 + i % 1500])
+            for i in range(4000)
+        ])
+        ConsultationMessage.objects.bulk_create([
+            ConsultationMessage(
+                from_user=consultation.to_user, consultation=consultation, message='Hello',
+                attachments=[ATTACHMENT] if i == 0 and consultation is consultations[0] else [],
+            )
+            for consultation in consultations
+            for i in range(5)
+        ])
+        Review.objects.bulk_create([
+            Review(from_user=consultation.to_user, to_doctor=consultation.from_doctor, rate=4, message='', consultation=consultation)
+            for consultation in consultations
+        ])
+        ConsultationStats.objects.bulk_create([
+            ConsultationStats(consultation=consultation, messages=5, last_message_at=timezone.now())
+            for consultation in consultations
+        ])
+        today = timezone.localdate()
+        DoctorDailyStats.objects.bulk_create([
+            DoctorDailyStats(doctor=doctor, day=today - timedelta(days=day), consultations=8, messages=40, reviews=8, rating_sum=32)
+            for doctor in doctors
+            for day in range(60)
+        ])
+        User.objects.filter(pk=users[-1].pk).update(is_staff=True)
+        speciality_stats.refresh(concurrently=False)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        cls.seed = {
+            'speciality': specialities[0],
+            'doctor': doctors[0],
+            'consultation': consultations[0],
+            'patient': consultations[0].to_user,
+            'admin': User.objects.get(pk=users[-1].pk),
+            'recent': (today - timedelta(days=7)).isoformat(),
+        }
+        cls.seed['doctor_user'] = cls.seed['doctor'].user
+
+    def request(self, name, endpoint):
+        client = APIClient()
+        user = endpoint.get('user')
+        if user is not None:
+            client.force_authenticate(self.seed['doctor_user' if user == 'doctor' else user])
+        kwargs = endpoint.get('kwargs', lambda seed: {})(self.seed)
+        query = {key: self.seed.get(value, value) for key, value in endpoint.get('query', {}).items()}
+        data = endpoint.get('data', lambda seed: None)(self.seed)
+        url = reverse(name, kwargs=kwargs)
+        if query:
+            url += '?' + urlencode(query)
+        with (
+            self.settings(**endpoint.get('settings', {})),
+            CaptureQueriesContext(connection) as queries,
+            # work deferred to after commit is part of the request's cost
+            self.captureOnCommitCallbacks(execute=True),
+        ):
+            response = getattr(client, endpoint.get('method', 'get'))(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, [query['sql'] for query in queries.captured_queries]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']
+
+    def test_every_route_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        self.assertEqual(names - set(ENDPOINTS), set(), 'routes without a query budget')
+
+    def test_query_plans(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('query plans are only checked on PostgreSQL')
+
+        for name, endpoint in ENDPOINTS.items():
+            with self.subTest(endpoint=name):
+                response, statements = self.request(name, endpoint)
+                self.assertLess(response.status_code, 300, getattr(response, 'data', response))
+
+                problems = []
+                statements = [sql for sql in statements if not sql.lstrip().upper().startswith(TRANSACTION_CONTROL)]
+                if len(statements) > endpoint['queries']:
+                    problems.append('%d queries, budget is %d' % (len(statements), endpoint['queries']))
+                for sql in statements:
+                    sql = DECLARE_RE.sub('', sql.lstrip())
+                    if not sql.upper().startswith(EXPLAINABLE):
+                        problems.append('not explained: %s' % sql)
+                        continue
+                    scanned = set(seq_scans(self.explain(sql))) & LARGE_TABLES
+                    scanned -= endpoint.get('seq_scans', set())
+                    if scanned:
+                        problems.append('seq scan on %s: %s' % (', '.join(sorted(scanned)), sql))
+                if problems:
+                    self.fail('\n'.join(['%s:' % name] + problems + ['all statements:'] + statements))
+
+
+@override_settings(MEDIA_SENDFILE_BACKEND=None)
+class MediaTests(TempMediaRootMixin, ConsultationTestData, TestCase):
+    AVATAR = 'users/avatar.png'
+    CYRILLIC_AVATAR = 'users/Снимок_экрана_6.png'
+    CONTENT = b'0123456789'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in (cls.AVATAR, cls.CYRILLIC_AVATAR, ATTACHMENT):
+            default_storage.save(name, ContentFile(cls.CONTENT))
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.stranger = create_user('stranger')
+        ConsultationMessage.objects.create(
+            from_user=cls.patient, consultation=cls.consultation, message='', attachments=[ATTACHMENT],
+        )
+
+    def get(self, path, user=None, **headers):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client.get('/media/' + path, headers=headers)
+
+    def test_public_file(self):
+        response = self.get(self.AVATAR)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.CONTENT)
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_attachment_visible_to_participant_only(self):
+        self.assertEqual(self.get(ATTACHMENT).status_code, 404)
+        self.assertEqual(self.get(ATTACHMENT, self.stranger).status_code, 404)
+        response = self.get(ATTACHMENT, self.patient)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_path_traversal(self):
+        for path in (
+            'users/../' + ATTACHMENT,
+            'users/./../' + ATTACHMENT,
+            'users//../' + ATTACHMENT,
+            './' + ATTACHMENT,
+            'users/..%2F' + ATTACHMENT,
+        ):
+            with self.subTest(path=path):
+                self.assertEqual(self.get(path).status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_BACKEND='nginx')
+    def test_path_traversal_not_delegated(self):
+        response = self.get('users/../' + ATTACHMENT)
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(self.get(self.AVATAR)['X-Accel-Redirect'], '/protected-media/' + self.AVATAR)
+
+    def test_delegated_non_ascii_name(self):
+        # header values outside latin-1 would be MIME-encoded, which neither server understands
+        quoted = 'users/%D0%A1%D0%BD%D0%B8%D0%BC%D0%BE%D0%BA_%D1%8D%D0%BA%D1%80%D0%B0%D0%BD%D0%B0_6.png'
+        with self.settings(MEDIA_SENDFILE_BACKEND='nginx'):
+            self.assertEqual(self.get(self.CYRILLIC_AVATAR)['X-Accel-Redirect'], '/protected-media/' + quoted)
+        with self.settings(MEDIA_SENDFILE_BACKEND='apache'):
+            header = self.get(self.CYRILLIC_AVATAR)['X-Sendfile']
+        self.assertTrue(header.isascii())
+        self.assertEqual(header, quote(os.path.join(self.media_root, self.CYRILLIC_AVATAR)))
+
+    def test_range(self):
+        response = self.get(self.AVATAR, Range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response.getvalue(), b'2345')
+
+        response = self.get(self.AVATAR, Range='bytes=-3')
+        self.assertEqual(response['Content-Range'], 'bytes 7-9/10')
+        self.assertEqual(response.getvalue(), b'789')
+
+        response = self.get(self.AVATAR, Range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_etag(self):
+        etag = self.get(self.AVATAR)['ETag']
+        self.assertEqual(self.get(self.AVATAR, If_None_Match=etag).status_code, 304)
+        # a stale If-Range sends the whole file instead of the range
+        response = self.get(self.AVATAR, Range='bytes=2-5', If_Range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.getvalue(), self.CONTENT)
+
+
+class JWTTests(TestCase):
+    def test_obtain_and_use_token(self):
+        user = User.objects.create_user(username='patient', email='patient@example.com', password='secret-password')
+        client = APIClient()
+        response = client.post('/auth/jwt/create/', {'username': 'patient', 'password': 'secret-password'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.post('/auth/jwt/verify/', {'token': response.data['access']}).status_code, 200)
+        self.assertIn('access', client.post('/auth/jwt/refresh/', {'refresh': response.data['refresh']}).data)
+
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + response.data['access'])
+        response = client.get(reverse('get_me'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], user.id)
+
+    def test_invalid_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer invalid')
+        self.assertEqual(client.get(reverse('get_me')).status_code, 401)
+        self.assertEqual(client.post('/auth/jwt/create/', {'username': 'nobody', 'password': 'x'}).status_code, 401)
+
+
+class SpecialityDirectoryTests(ConsultationTestData, TestCase):
+    def test_counts_before_and_after_refresh(self):
+        Review.objects.create(from_user=self.patient, to_doctor=self.doctor, rate=4, message='')
+        url = reverse('speciality_detail', kwargs={'pk': self.speciality.pk})
+
+        response = APIClient().get(url)
+        self.assertEqual(
+            (response.data['doctors_count'], response.data['reviews_count'], response.data['average_rating']),
+            (0, 0, None),
+        )
+
+        speciality_stats.refresh()
+        response = APIClient().get(url)
+        self.assertEqual(
+            (response.data['doctors_count'], response.data['reviews_count'], response.data['average_rating']),
+            (1, 1, 4),
+        )
+        self.assertEqual(APIClient().get(reverse('speciality_list')).data[0]['doctors_count'], 1)
@@ -10,4 +10,9 @@ urlpatterns = [
     path('api/v1/specialities/<int:pk>', views.SpecialityDetailView.as_view(), name='speciality_detail'),
     path('api/v1/doctors/<int:pk>', views.DoctorDetailView.as_view(), name='doctors_detail'),
     path('consultations/<int:consultation_id>/reviews/', views.ConsultationReviewView.as_view(), name='review_list_create'),
+    path('api/v1/consultations/<int:pk>/export', views.ConsultationExportView.as_view(), name='consultation_export'),
+    path('api/v1/stats/overview/', views.StatsOverviewView.as_view(), name='stats_overview'),
+    path('api/v1/stats/doctors/<int:pk>', views.DoctorStatsView.as_view(), name='doctor_stats'),
+    path('api/v1/stats/consultations/', views.ConsultationStatsListView.as_view(), name='consultation_stats'),
+    path('media/<path:path>', views.MediaView.as_view(), name='media'),
 ]
\ No newline at end of file
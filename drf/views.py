@@ -1,8 +1,24 @@
+from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_date
 from rest_framework import generics
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
-from .serializers import *
-from med.models import *
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from . import export, media
+from .permissions import IsAdmin, IsConsultationParticipant, consultation_participant_q, is_admin
+from .serializers import (
+    ConsultationStatsSerializer,
+    DoctorDailyStatsSerializer,
+    DoctorSerializer,
+    ReviewSerializer,
+    SpecialityDirectorySerializer,
+    UserEditSerializer,
+    UserSerializer,
+)
+from med.models import Consultation, ConsultationStats, Doctor, DoctorDailyStats, Review, Speciality
 
 
 class ProfileUpdateView(generics.RetrieveUpdateAPIView):
@@ -23,22 +39,22 @@ class GetMeView(generics.RetrieveAPIView):
 
 
 class SpecialityListView(generics.ListAPIView):
-    queryset = Speciality.objects.all()
-    serializer_class = SpeicalitySerializer
+    queryset = Speciality.objects.select_related('stats')
+    serializer_class = SpecialityDirectorySerializer
 
 
 class DoctorListView(generics.ListAPIView):
-    queryset = Doctor.objects.all()
+    queryset = Doctor.objects.select_related('user', 'speciality')
     serializer_class = DoctorSerializer
 
 
 class SpecialityDetailView(generics.RetrieveAPIView):
-    queryset = Speciality.objects.all()
-    serializer_class = SpeicalitySerializer
+    queryset = Speciality.objects.select_related('stats')
+    serializer_class = SpecialityDirectorySerializer
 
 
 class DoctorDetailView(generics.RetrieveAPIView):
-    queryset = Doctor.objects.all()
+    queryset = Doctor.objects.select_related('user', 'speciality')
     serializer_class = DoctorSerializer
 
 
@@ -51,3 +67,86 @@ class ConsultationReviewView(generics.CreateAPIView):
         consultation_id = self.kwargs['consultation_id']
         consultation = Consultation.objects.get(id=consultation_id)
         serializer.save(consultation=consultation)
+
+
+class FileDownloadMixin:
+    def perform_content_negotiation(self, request, force=False):
+        # downloads send arbitrary Accept headers, the body isn't rendered anyway
+        return super().perform_content_negotiation(request, force=True)
+
+
+class MediaView(FileDownloadMixin, APIView):
+    def get(self, request, path):
+        return media.serve(request, path)
+
+
+class StatsRangeMixin:
+    def filter_days(self, queryset):
+        params = self.request.query_params
+        for param, lookup in (('date_from', 'day__gte'), ('date_to', 'day__lte')):
+            if param not in params:
+                continue
+            try:
+                day = parse_date(params[param])
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({param: 'Expected a date in YYYY-MM-DD format.'})
+            queryset = queryset.filter(**{lookup: day})
+        return queryset
+
+
+class DoctorStatsView(StatsRangeMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = DoctorDailyStatsSerializer
+
+    def get_queryset(self):
+        doctor = generics.get_object_or_404(Doctor, pk=self.kwargs['pk'])
+        if not is_admin(self.request.user) and doctor.user_id != self.request.user.id:
+            raise PermissionDenied
+        return self.filter_days(DoctorDailyStats.objects.filter(doctor=doctor).order_by('day'))
+
+
+class ConsultationStatsListView(generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ConsultationStatsSerializer
+
+    def get_queryset(self):
+        queryset = ConsultationStats.objects.order_by('-last_message_at')
+        if not is_admin(self.request.user):
+            queryset = queryset.filter(consultation_participant_q(self.request.user, 'consultation__'))
+        return queryset
+
+
+class StatsOverviewView(StatsRangeMixin, APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        rows = (
+            self.filter_days(DoctorDailyStats.objects.all())
+            .values('day')
+            .annotate(
+                consultations=Sum('consultations'),
+                messages=Sum('messages'),
+                reviews=Sum('reviews'),
+                rating_sum=Sum('rating_sum'),
+            )
+            .order_by('day')
+        )
+        days = []
+        for row in rows:
+            rating_sum = row.pop('rating_sum')
+            row['average_rating'] = rating_sum / row['reviews'] if row['reviews'] else None
+            days.append(row)
+        return Response(days)
+
+
+class ConsultationExportView(FileDownloadMixin, generics.GenericAPIView):
+    permission_classes = [IsAuthenticated, IsConsultationParticipant]
+    queryset = Consultation.objects.select_related('from_doctor', 'to_user')
+
+    def get(self, request, pk):
+        consultation = self.get_object()
+        response = StreamingHttpResponse(export.transcript_zip(consultation), content_type='application/zip')
+        response['Content-Disposition'] = 'attachment; filename="consultation-%d.zip"' % consultation.pk
+        return response
@@ -1,8 +1,49 @@
-from django.contrib import admin
-from .models import *
+from django.contrib import admin, messages
+from . import erasure
+from .models import Consultation, ConsultationMessage, Doctor, Review, Speciality, User
+
+
+# Admin actions erase inside the request. Larger selections are refused and
+# left to `manage.py erase_user`, which shows progress and can't time out.
+ADMIN_ERASURE_MAX_ROWS = 5000
+
+
+def erasure_action(erase, plan, anonymize, description):
+    @admin.action(description=description, permissions=['delete'])
+    def action(modeladmin, request, queryset):
+        size = sum(erasure.plan_size(plan(obj, anonymize)) for obj in queryset)
+        if size > ADMIN_ERASURE_MAX_ROWS:
+            modeladmin.message_user(
+                request,
+                'The selection touches %d rows, more than the %d the admin erases in one request. '
+                'Use "manage.py erase_user" instead.' % (size, ADMIN_ERASURE_MAX_ROWS),
+                messages.ERROR,
+            )
+            return
+        rows = 0
+        for obj in queryset:
+            rows += sum(erase(obj, anonymize=anonymize).values())
+        modeladmin.message_user(request, '%d records processed, %d rows affected.' % (len(queryset), rows))
+    action.__name__ = '%s_%s' % (erase.__name__, 'anonymize' if anonymize else 'delete')
+    return action
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    actions = [
+        erasure_action(erasure.erase_user, erasure.user_plan, False, 'Erase selected users with their history'),
+        erasure_action(erasure.erase_user, erasure.user_plan, True, 'Anonymize selected users'),
+    ]
+
+
+@admin.register(Doctor)
+class DoctorAdmin(admin.ModelAdmin):
+    actions = [
+        erasure_action(erasure.erase_doctor, erasure.single_doctor_plan, False, 'Erase selected doctors with their consultations'),
+        erasure_action(erasure.erase_doctor, erasure.single_doctor_plan, True, 'Anonymize selected doctors'),
+    ]
+
 
-admin.site.register(Doctor)
-admin.site.register(User)
 admin.site.register(Speciality)
 admin.site.register(Consultation)
 admin.site.register(ConsultationMessage)
@@ -0,0 +1,138 @@
+"""
+Removal of a user's or doctor's data without the ORM cascade.
+
+Deleting a User through Django loads every dependent Consultation,
+ConsultationMessage and Review into memory first. Here the dependents are
+removed (or scrubbed) children first, in primary key chunks, each chunk in its
+own transaction, so once the parent row is deleted nothing big is left for
+the collector to find.
+"""
+from django.core.files.storage import default_storage
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from . import rollups
+from .models import Consultation, ConsultationMessage, ConsultationStats, Doctor, DoctorDailyStats, Review
+
+DELETE = 'delete'
+
+
+def _remove_files_on_commit(names):
+    names = [name for name in names if name]
+    if names:
+        transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def _consultation_steps(role, consultations):
+    return [
+        ('%s consultation messages' % role, ConsultationMessage.objects.filter(consultation__in=consultations), DELETE),
+        ('%s consultation reviews' % role, Review.objects.filter(consultation__in=consultations), DELETE),
+        ('%s consultation statistics' % role, ConsultationStats.objects.filter(consultation__in=consultations), DELETE),
+        ('%s consultations' % role, Consultation.objects.filter(pk__in=consultations), DELETE),
+    ]
+
+
+def doctor_plan(doctors, anonymize=False):
+    """Steps for a queryset of Doctor primary keys."""
+    if anonymize:
+        return [
+            ('doctor profiles', Doctor.objects.filter(pk__in=doctors),
+             {'first_name': '', 'last_name': '', 'surname': '', 'description': ''}),
+        ]
+    return _consultation_steps('doctor', Consultation.objects.filter(from_doctor__in=doctors).values('pk')) + [
+        ('doctor reviews', Review.objects.filter(to_doctor__in=doctors), DELETE),
+        ('doctor statistics', DoctorDailyStats.objects.filter(doctor__in=doctors), DELETE),
+        ('doctor profiles', Doctor.objects.filter(pk__in=doctors), DELETE),
+    ]
+
+
+def single_doctor_plan(doctor, anonymize=False):
+    return doctor_plan(Doctor.objects.filter(pk=doctor.pk).values('pk'), anonymize)
+
+
+def user_plan(user, anonymize=False):
+    doctors = Doctor.objects.filter(user=user).values('pk')
+    if anonymize:
+        return doctor_plan(doctors, anonymize=True) + [
+            ('authored messages', ConsultationMessage.objects.filter(from_user=user), {'message': '', 'attachments': []}),
+            ('authored reviews', Review.objects.filter(from_user=user), {'message': ''}),
+        ]
+    return (
+        doctor_plan(doctors)
+        + _consultation_steps('patient', Consultation.objects.filter(to_user=user).values('pk'))
+        + [
+            ('authored messages', ConsultationMessage.objects.filter(from_user=user), DELETE),
+            ('authored reviews', Review.objects.filter(from_user=user), DELETE),
+        ]
+    )
+
+
+def run_step(label, queryset, action, chunk_size=1000, progress=None):
+    """
+    Delete or update the rows of ``queryset`` in primary key order, one
+    transaction per chunk. ``progress(label, done, total)`` is called after
+    every chunk.
+    """
+    model = queryset.model
+    total = queryset.count()
+    done = 0
+    last_pk = None
+    if progress is not None:
+        progress(label, done, total)
+    while True:
+        page = queryset.order_by('pk')
+        if last_pk is not None:
+            page = page.filter(pk__gt=last_pk)
+        with transaction.atomic():
+            pks = list(page.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return done
+            chunk = model._base_manager.filter(pk__in=pks)
+            if model is ConsultationMessage:
+                _remove_files_on_commit([name for names in chunk.values_list('attachments', flat=True) for name in names])
+            if action == DELETE:
+                # keep the other party's daily statistics in line with a rebuild
+                rollups.discount(chunk)
+                chunk.delete()
+            else:
+                chunk.update(**action)
+        last_pk = pks[-1]
+        done += len(pks)
+        if progress is not None:
+            progress(label, done, total)
+
+
+def plan_size(plan):
+    return sum(queryset.count() for _, queryset, _ in plan)
+
+
+def run_plan(plan, chunk_size=1000, progress=None):
+    return {label: run_step(label, queryset, action, chunk_size, progress) for label, queryset, action in plan}
+
+
+def erase_user(user, anonymize=False, chunk_size=1000, progress=None):
+    """
+    Delete a user with their whole history, or with ``anonymize`` keep the
+    consultations and ratings but scrub everything that identifies them.
+    Returns the number of rows touched per step.
+    """
+    counts = run_plan(user_plan(user, anonymize), chunk_size, progress)
+    with transaction.atomic():
+        _remove_files_on_commit([user.avatar.name])
+        if anonymize:
+            user.username = 'deleted-%d' % user.pk
+            user.email = 'deleted-%d@invalid' % user.pk
+            user.first_name = user.last_name = ''
+            user.avatar = None
+            user.is_active = user.is_staff = user.is_superuser = False
+            user.set_unusable_password()
+            user.save()
+            Token.objects.filter(user=user).delete()
+        else:
+            user.delete()
+    counts['user'] = 1
+    return counts
+
+
+def erase_doctor(doctor, anonymize=False, chunk_size=1000, progress=None):
+    return run_plan(single_doctor_plan(doctor, anonymize), chunk_size, progress)
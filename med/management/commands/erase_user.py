@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from med import erasure
+from med.models import Doctor
+
+
+class Command(BaseCommand):
+    help = 'Delete or anonymize users (or doctor profiles) with their history in chunked, set-based steps'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('identifiers', nargs='+', help='usernames, or doctor ids with --doctor')
+        parser.add_argument('--doctor', action='store_true', help='erase doctor profiles instead of users')
+        parser.add_argument('--anonymize', action='store_true', help='scrub personal data instead of deleting rows')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='only print how many rows each step would touch')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **options):
+        targets = self.get_targets(options['identifiers'], options['doctor'])
+        for target in targets:
+            if options['doctor']:
+                plan = erasure.single_doctor_plan(target, options['anonymize'])
+            else:
+                plan = erasure.user_plan(target, options['anonymize'])
+            self.stdout.write('%s %r:' % ('Anonymizing' if options['anonymize'] else 'Erasing', str(target)))
+            for label, queryset, action in plan:
+                self.stdout.write('  %-34s %d rows' % (label, queryset.count()))
+            if options['dry_run']:
+                continue
+            if options['interactive'] and input('Type "yes" to continue: ') != 'yes':
+                self.stdout.write('Skipped.')
+                continue
+
+            if options['doctor']:
+                erasure.erase_doctor(target, options['anonymize'], options['chunk_size'], self.report)
+            else:
+                erasure.erase_user(target, options['anonymize'], options['chunk_size'], self.report)
+            self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def get_targets(self, identifiers, doctors):
+        if doctors:
+            if not all(identifier.isdigit() for identifier in identifiers):
+                raise CommandError('Doctor ids must be integers')
+            targets = Doctor.objects.filter(pk__in=identifiers)
+            found = {str(doctor.pk) for doctor in targets}
+        else:
+            targets = get_user_model().objects.filter(username__in=identifiers)
+            found = {user.username for user in targets}
+        missing = set(identifiers) - found
+        if missing:
+            raise CommandError('Not found: %s' % ', '.join(sorted(missing)))
+        return list(targets)
+
+    def report(self, label, done, total):
+        self.stdout.write('\r  %-34s %d/%d' % (label, done, total), ending='\n' if done >= total else '')
+        self.stdout.flush()
@@ -0,0 +1,131 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter so nothing is already imported. Wraps
+# AppConfig.create to time each app's module import, models import and ready().
+PROBE = """
+import json, sys, time
+
+started = time.perf_counter()
+import django
+from django.apps.config import AppConfig
+from django.conf import settings
+
+settings.INSTALLED_APPS
+settings_loaded = time.perf_counter()
+apps = {}
+create = AppConfig.create.__func__
+
+
+def timed(label, phase, method):
+    def wrapper():
+        start = time.perf_counter()
+        method()
+        apps[label][phase] += time.perf_counter() - start
+    return wrapper
+
+
+def timed_create(cls, entry):
+    start = time.perf_counter()
+    app_config = create(cls, entry)
+    apps[app_config.label] = {'import': time.perf_counter() - start, 'models': 0.0, 'ready': 0.0}
+    app_config.import_models = timed(app_config.label, 'models', app_config.import_models)
+    app_config.ready = timed(app_config.label, 'ready', app_config.ready)
+    return app_config
+
+
+AppConfig.create = classmethod(timed_create)
+django.setup()
+setup_done = time.perf_counter()
+if 'urls' in sys.argv:
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+finished = time.perf_counter()
+
+print(json.dumps({
+    'phases': {
+        'interpreter+settings': settings_loaded - started,
+        'app registry': setup_done - settings_loaded,
+        'urlconf': finished - setup_done,
+        'total': finished - started,
+    },
+    'apps': apps,
+}))
+"""
+
+
+def parse_importtime(output):
+    """Cumulative import time of top-level imports, grouped by root package."""
+    packages = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            continue
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(cumulative) / 1e6
+    return packages
+
+
+def median_of(runs):
+    keys = {key for run in runs for key in run}
+    return {key: statistics.median(run.get(key, 0.0) for run in runs) for key in keys}
+
+
+class Command(BaseCommand):
+    help = 'Measure cold start cost: import time per package and import/models/ready time per app'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3, help='number of fresh interpreters to sample (median is reported)')
+        parser.add_argument('--top', type=int, default=15, help='number of packages to list')
+        parser.add_argument('--no-urls', action='store_true', help="don't import the URLconf, as management commands don't")
+        parser.add_argument('--json', action='store_true', help='print raw medians as JSON')
+
+    def handle(self, *args, **options):
+        runs = [self.sample(not options['no_urls']) for _ in range(max(options['repeat'], 1))]
+        phases = median_of([run['phases'] for run in runs])
+        labels = list(runs[0]['apps'])
+        apps = {
+            label: median_of([run['apps'].get(label, {}) for run in runs])
+            for label in labels
+        }
+        packages = median_of([run['packages'] for run in runs])
+
+        if options['json']:
+            self.stdout.write(json.dumps({'phases': phases, 'apps': apps, 'packages': packages}, indent=2))
+            return
+
+        self.stdout.write('Startup (median of %d runs, ms)' % len(runs))
+        for phase in ('interpreter+settings', 'app registry', 'urlconf', 'total'):
+            self.stdout.write('  %-22s %8.1f' % (phase, phases[phase] * 1000))
+
+        self.stdout.write('\n%-22s %8s %8s %8s' % ('App', 'import', 'models', 'ready'))
+        for label in labels:
+            timing = apps[label]
+            self.stdout.write('%-22s %8.1f %8.1f %8.1f' % (
+                label, timing['import'] * 1000, timing['models'] * 1000, timing['ready'] * 1000,
+            ))
+
+        self.stdout.write('\n%-28s %8s' % ('Package', 'import'))
+        for package, seconds in sorted(packages.items(), key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write('%-28s %8.1f' % (package, seconds * 1000))
+
+    def sample(self, load_urls):
+        command = [sys.executable, '-X', 'importtime', '-c', PROBE]
+        if load_urls:
+            command.append('urls')
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'consultation.settings'))
+        result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        if result.returncode:
+            raise CommandError((result.stderr.strip().splitlines() or ['startup probe failed'])[-1])
+        run = json.loads(result.stdout.strip().splitlines()[-1])
+        run['packages'] = parse_importtime(result.stderr)
+        return run
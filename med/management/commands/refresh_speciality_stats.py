@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from med import speciality_stats
+
+
+class Command(BaseCommand):
+    help = 'Refresh the per-speciality doctor count and rating materialized view; schedule it every minute or so'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocking', action='store_true', help='refresh without CONCURRENTLY, locking out readers')
+
+    def handle(self, *args, **options):
+        if speciality_stats.refresh(concurrently=not options['blocking']):
+            self.stdout.write(self.style.SUCCESS('Speciality statistics refreshed.'))
+        else:
+            self.stdout.write(self.style.WARNING('Another refresh is running, skipped.'))
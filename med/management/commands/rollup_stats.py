@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from med import rollups
+
+
+class Command(BaseCommand):
+    help = 'Fold new consultations, messages and reviews into the daily statistics rollups'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--trailing-days', type=int, default=2,
+            help='recompute the doctor rollups of this many days up to today to pick up rows that '
+                 'committed late (default 2, 0 to skip); ignored with --rebuild-from',
+        )
+        parser.add_argument('--rebuild-from', help='recompute doctor rollups starting at this date (YYYY-MM-DD)')
+        parser.add_argument('--rebuild-to', help='last day to recompute, defaults to --rebuild-from')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        day_from = day_to = None
+        if options['rebuild_from']:
+            try:
+                day_from = parse_date(options['rebuild_from'])
+                day_to = parse_date(options['rebuild_to'] or options['rebuild_from'])
+            except ValueError:
+                day_from = None
+            if day_from is None or day_to is None:
+                raise CommandError('Dates must be in YYYY-MM-DD format')
+        elif options['trailing_days'] > 0:
+            day_to = timezone.localdate()
+            day_from = day_to - timedelta(days=options['trailing_days'] - 1)
+
+        totals = rollups.catch_up(options['batch_size'], progress=self.report)
+        self.stdout.write(self.style.SUCCESS('Caught up: %s' % self.describe(totals)))
+
+        if day_from is not None:
+            rebuilt = rollups.rebuild(day_from, day_to)
+            self.stdout.write(self.style.SUCCESS('Rebuilt %d doctor days' % rebuilt))
+
+    def report(self, totals):
+        if self.verbosity > 1:
+            self.stdout.write(self.describe(totals))
+
+    def describe(self, totals):
+        return ', '.join('%s=%d' % item for item in totals.items())
@@ -0,0 +1,77 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:46
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_watermarks(apps, schema_editor):
+    RollupWatermark = apps.get_model('med', 'RollupWatermark')
+    RollupWatermark.objects.bulk_create([
+        RollupWatermark(source=source) for source in ('consultation', 'message', 'review')
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0011_rename_image_user_avatar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsultationStats',
+            fields=[
+                ('consultation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='med.consultation')),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='consultationmessage',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        # existing rows got the migration time; the consultation's date is the
+        # closest known value (reviews without a consultation keep it)
+        migrations.RunSQL(
+            [
+                'UPDATE med_consultationmessage AS m SET date_created = c.date_created '
+                'FROM med_consultation AS c WHERE m.consultation_id = c.id',
+                'UPDATE med_review AS r SET date_created = c.date_created '
+                'FROM med_consultation AS c WHERE r.consultation_id = c.id',
+            ],
+            migrations.RunSQL.noop,
+        ),
+        migrations.CreateModel(
+            name='DoctorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('consultations', models.PositiveIntegerField(default=0)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('reviews', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.FloatField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='med.doctor')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='unique_doctor_day_stats')],
+            },
+        ),
+        migrations.RunPython(create_watermarks, migrations.RunPython.noop),
+    ]
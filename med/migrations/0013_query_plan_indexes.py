@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-19 15:30
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0012_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='consultationmessage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['attachments'], name='med_consult_attachm_821ebd_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='doctordailystats',
+            index=models.Index(fields=['day'], name='med_doctord_day_ac944d_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-19 14:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+CREATE_VIEW = '''
+CREATE MATERIALIZED VIEW med_specialitystats AS
+SELECT speciality.id AS speciality_id,
+       COUNT(DISTINCT doctor.id) AS doctors_count,
+       COUNT(review.id) AS reviews_count,
+       AVG(review.rate) AS average_rating
+FROM med_speciality speciality
+LEFT JOIN med_doctor doctor ON doctor.speciality_id = speciality.id
+LEFT JOIN med_review review ON review.to_doctor_id = doctor.id
+GROUP BY speciality.id;
+
+CREATE UNIQUE INDEX med_specialitystats_speciality_id ON med_specialitystats (speciality_id);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('med', '0013_query_plan_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpecialityStats',
+            fields=[
+                ('speciality', models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='stats', serialize=False, to='med.speciality')),
+                ('doctors_count', models.PositiveIntegerField()),
+                ('reviews_count', models.PositiveIntegerField()),
+                ('average_rating', models.FloatField(null=True)),
+            ],
+            options={
+                'db_table': 'med_specialitystats',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, 'DROP MATERIALIZED VIEW med_specialitystats;'),
+    ]
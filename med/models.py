@@ -2,6 +2,7 @@ from django.db import models
 import enum
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -56,6 +57,12 @@ class ConsultationMessage(models.Model):
     attachments = ArrayField(
         models.ImageField(upload_to='message_images')
     )
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['attachments']),
+        ]
 
 
 class Review(models.Model):
@@ -63,4 +70,52 @@ class Review(models.Model):
     to_doctor = models.ForeignKey(to=Doctor, on_delete=models.CASCADE)
     rate = models.FloatField(validators=[MinValueValidator(1.0), MaxValueValidator(5.0)])
     message = models.TextField()
-    consultation = models.ForeignKey(to=Consultation, on_delete=models.CASCADE, null=True, blank=True)
\ No newline at end of file
+    consultation = models.ForeignKey(to=Consultation, on_delete=models.CASCADE, null=True, blank=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+
+
+class DoctorDailyStats(models.Model):
+    doctor = models.ForeignKey(to=Doctor, on_delete=models.CASCADE)
+    day = models.DateField()
+    consultations = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    reviews = models.PositiveIntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'day'], name='unique_doctor_day_stats'),
+        ]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.reviews if self.reviews else None
+
+
+class ConsultationStats(models.Model):
+    consultation = models.OneToOneField(to=Consultation, on_delete=models.CASCADE, primary_key=True)
+    messages = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+
+class SpecialityStats(models.Model):
+    # read-only, backed by a materialized view (see med/speciality_stats.py)
+    speciality = models.OneToOneField(to=Speciality, on_delete=models.DO_NOTHING, primary_key=True, related_name='stats')
+    doctors_count = models.PositiveIntegerField()
+    reviews_count = models.PositiveIntegerField()
+    average_rating = models.FloatField(null=True)
+
+    class Meta:
+        managed = False
+        db_table = 'med_specialitystats'
+
+
+class RollupWatermark(models.Model):
+    source = models.CharField(max_length=32, unique=True)
+    last_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return self.source
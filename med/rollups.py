@@ -0,0 +1,263 @@
+"""
+Daily statistics kept in DoctorDailyStats and ConsultationStats.
+
+Every source table has a RollupWatermark holding the last primary key that was
+folded into the rollups, so catch_up() only reads rows created since the
+previous run. All rollup writers take the watermark rows FOR UPDATE, which
+serializes them and keeps the read-modify-write of the rollup rows safe.
+
+Ids are handed out before commit, so a row can become visible after a row
+with a higher id. Rows younger than ANALYTICS_ROLLUP_SAFETY_LAG are left for
+a later run, and rebuild() of the trailing days repairs the rare transaction
+that stays open longer than that.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from itertools import takewhile
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Consultation, ConsultationMessage, ConsultationStats, DoctorDailyStats, Review, RollupWatermark
+
+DOCTOR_DAY_FIELDS = ('consultations', 'messages', 'reviews', 'rating_sum')
+
+# rows folded per source by the on-commit hook; the rest is left to rollup_stats
+ON_WRITE_BATCH_SIZE = 100
+
+
+def _doctor_day_deltas():
+    return defaultdict(lambda: dict.fromkeys(DOCTOR_DAY_FIELDS, 0))
+
+
+def _existing_doctor_days(deltas):
+    existing = DoctorDailyStats.objects.filter(
+        doctor_id__in={doctor_id for doctor_id, _ in deltas},
+        day__in={day for _, day in deltas},
+    )
+    return {(stats.doctor_id, stats.day): stats for stats in existing}
+
+
+def _merge_doctor_days(deltas):
+    if not deltas:
+        return
+    existing = _existing_doctor_days(deltas)
+    created, updated = [], []
+    for (doctor_id, day), delta in deltas.items():
+        stats = existing.get((doctor_id, day))
+        if stats is None:
+            created.append(DoctorDailyStats(doctor_id=doctor_id, day=day, **delta))
+            continue
+        for field, value in delta.items():
+            setattr(stats, field, getattr(stats, field) + value)
+        updated.append(stats)
+    DoctorDailyStats.objects.bulk_create(created)
+    DoctorDailyStats.objects.bulk_update(updated, DOCTOR_DAY_FIELDS)
+
+
+def _merge_consultations(deltas):
+    if not deltas:
+        return
+    existing = ConsultationStats.objects.in_bulk(deltas.keys())
+    created, updated = [], []
+    for consultation_id, (messages, last_message_at) in deltas.items():
+        stats = existing.get(consultation_id)
+        if stats is None:
+            created.append(ConsultationStats(
+                consultation_id=consultation_id, messages=messages, last_message_at=last_message_at,
+            ))
+            continue
+        stats.messages += messages
+        stats.last_message_at = max(filter(None, (stats.last_message_at, last_message_at)))
+        updated.append(stats)
+    ConsultationStats.objects.bulk_create(created)
+    ConsultationStats.objects.bulk_update(updated, ('messages', 'last_message_at'))
+
+
+def _settled_rows(queryset, last_id, batch_size, cutoff, *fields):
+    """
+    Up to ``batch_size`` rows after ``last_id`` in id order, as (id,
+    date_created, *fields) tuples, stopping at the first row created after
+    ``cutoff``: an uncommitted row below it may still show up.
+    """
+    rows = queryset.filter(id__gt=last_id).order_by('id').values_list('id', 'date_created', *fields)[:batch_size]
+    return list(takewhile(lambda row: row[1] < cutoff, rows))
+
+
+def _ingest_consultations(last_id, batch_size, cutoff):
+    rows = _settled_rows(Consultation.objects, last_id, batch_size, cutoff, 'from_doctor_id')
+    deltas = _doctor_day_deltas()
+    for _, date_created, doctor_id in rows:
+        deltas[doctor_id, timezone.localdate(date_created)]['consultations'] += 1
+    _merge_doctor_days(deltas)
+    return rows
+
+
+def _ingest_messages(last_id, batch_size, cutoff):
+    rows = _settled_rows(
+        ConsultationMessage.objects, last_id, batch_size, cutoff, 'consultation_id', 'consultation__from_doctor_id',
+    )
+    deltas = _doctor_day_deltas()
+    consultations = {}
+    for _, date_created, consultation_id, doctor_id in rows:
+        deltas[doctor_id, timezone.localdate(date_created)]['messages'] += 1
+        messages, last_message_at = consultations.get(consultation_id, (0, date_created))
+        consultations[consultation_id] = messages + 1, max(last_message_at, date_created)
+    _merge_doctor_days(deltas)
+    _merge_consultations(consultations)
+    return rows
+
+
+def _ingest_reviews(last_id, batch_size, cutoff):
+    rows = _settled_rows(Review.objects, last_id, batch_size, cutoff, 'to_doctor_id', 'rate')
+    deltas = _doctor_day_deltas()
+    for _, date_created, doctor_id, rate in rows:
+        delta = deltas[doctor_id, timezone.localdate(date_created)]
+        delta['reviews'] += 1
+        delta['rating_sum'] += rate
+    _merge_doctor_days(deltas)
+    return rows
+
+
+INGESTERS = {
+    'consultation': _ingest_consultations,
+    'message': _ingest_messages,
+    'review': _ingest_reviews,
+}
+
+
+def _lock_watermarks(skip_locked=False):
+    return RollupWatermark.objects.select_for_update(skip_locked=skip_locked).in_bulk(
+        INGESTERS.keys(), field_name='source',
+    )
+
+
+def fold(batch_size=1000, skip_locked=False):
+    """
+    Fold at most ``batch_size`` settled rows per source in one transaction.
+    With ``skip_locked`` sources another writer is busy with are skipped
+    instead of waited for. Returns the number of rows read per source.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.ANALYTICS_ROLLUP_SAFETY_LAG)
+    with transaction.atomic():
+        counts = {}
+        for source, watermark in _lock_watermarks(skip_locked).items():
+            rows = INGESTERS[source](watermark.last_id, batch_size, cutoff)
+            if rows:
+                watermark.last_id = rows[-1][0]
+                watermark.save(update_fields=['last_id'])
+            counts[source] = len(rows)
+        return counts
+
+
+def fold_on_write():
+    fold(ON_WRITE_BATCH_SIZE, skip_locked=True)
+
+
+def catch_up(batch_size=1000, progress=None):
+    """
+    Fold rows created since the last run into the rollups, one bounded
+    transaction per batch, until no settled rows are left. Returns the number
+    of rows read per source.
+    """
+    totals = dict.fromkeys(INGESTERS, 0)
+    while True:
+        counts = fold(batch_size)
+        for source, count in counts.items():
+            totals[source] += count
+        if progress is not None:
+            progress(totals)
+        if all(count < batch_size for count in counts.values()):
+            return totals
+
+
+# source -> (doctor of a row, its DoctorDailyStats aggregates)
+DOCTOR_DAY_SOURCES = {
+    'consultation': ('from_doctor_id', {'consultations': Count('id')}),
+    'message': ('consultation__from_doctor_id', {'messages': Count('id')}),
+    'review': ('to_doctor_id', {'reviews': Count('id'), 'rating_sum': Sum('rate')}),
+}
+SOURCE_MODELS = {Consultation: 'consultation', ConsultationMessage: 'message', Review: 'review'}
+
+
+def _add_doctor_days(deltas, source, queryset, watermark, sign=1):
+    doctor_field, aggregates = DOCTOR_DAY_SOURCES[source]
+    rows = (
+        queryset.filter(id__lte=watermark.last_id)
+        .values(doctor=F(doctor_field), day=TruncDate('date_created'))
+        .annotate(**aggregates)
+        .order_by()
+    )
+    for row in rows:
+        delta = deltas[row['doctor'], row['day']]
+        for field in aggregates:
+            delta[field] += sign * row[field]
+
+
+def discount(queryset):
+    """
+    Take the rows of ``queryset`` back out of the rollups before they are
+    deleted, in the same transaction. Rows above the watermark were never
+    counted.
+    """
+    source = SOURCE_MODELS.get(queryset.model)
+    if source is None:
+        return
+    watermark = _lock_watermarks()[source]
+    deltas = _doctor_day_deltas()
+    _add_doctor_days(deltas, source, queryset, watermark, sign=-1)
+    existing = _existing_doctor_days(deltas)
+    for key, stats in existing.items():
+        for field, value in deltas[key].items():
+            setattr(stats, field, max(getattr(stats, field) + value, 0))
+    DoctorDailyStats.objects.bulk_update(existing.values(), DOCTOR_DAY_FIELDS)
+
+    if source == 'message':
+        counts = dict(
+            queryset.filter(id__lte=watermark.last_id)
+            .values_list('consultation_id').annotate(Count('id')).order_by()
+        )
+        consultations = ConsultationStats.objects.in_bulk(counts.keys())
+        for consultation_id, stats in consultations.items():
+            stats.messages = max(stats.messages - counts[consultation_id], 0)
+        ConsultationStats.objects.bulk_update(consultations.values(), ['messages'])
+
+
+def rebuild(day_from, day_to):
+    """
+    Recompute the doctor rollups of [day_from, day_to] from the source tables.
+
+    Catches rows that committed with an id below an already advanced
+    watermark. Only rows at or below the watermarks are counted so the next
+    catch_up() doesn't fold them in a second time.
+    """
+    with transaction.atomic():
+        watermarks = _lock_watermarks()
+        deltas = _doctor_day_deltas()
+        for model, source in SOURCE_MODELS.items():
+            queryset = model.objects.filter(date_created__date__gte=day_from, date_created__date__lte=day_to)
+            _add_doctor_days(deltas, source, queryset, watermarks[source])
+        DoctorDailyStats.objects.filter(day__gte=day_from, day__lte=day_to).delete()
+        _merge_doctor_days(deltas)
+
+        consultation_ids = ConsultationMessage.objects.filter(
+            id__lte=watermarks['message'].last_id,
+            date_created__date__gte=day_from,
+            date_created__date__lte=day_to,
+        ).values('consultation_id')
+        consultations = (
+            ConsultationMessage.objects
+            .filter(id__lte=watermarks['message'].last_id, consultation_id__in=consultation_ids)
+            .values('consultation_id')
+            .annotate(messages=Count('id'), last_message_at=Max('date_created'))
+        )
+        ConsultationStats.objects.bulk_create(
+            [ConsultationStats(**row) for row in consultations],
+            update_conflicts=True,
+            unique_fields=['consultation'],
+            update_fields=['messages', 'last_message_at'],
+        )
+        return len(deltas)
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Consultation, ConsultationMessage, Review
+
+
+@receiver(post_save, sender=Consultation)
+@receiver(post_save, sender=ConsultationMessage)
+@receiver(post_save, sender=Review)
+def update_rollups(sender, created, **kwargs):
+    if created and settings.ANALYTICS_ROLLUP_ON_WRITE:
+        from . import rollups
+        transaction.on_commit(rollups.fold_on_write, robust=True)
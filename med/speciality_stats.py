@@ -0,0 +1,28 @@
+"""
+Doctor counts and ratings per speciality, kept in the med_specialitystats
+materialized view so the speciality endpoints don't aggregate doctors and
+reviews on every call.
+
+The view is refreshed by the refresh_speciality_stats command, scheduled
+every minute or so, never inside a request. The unique index on
+speciality_id lets it be refreshed CONCURRENTLY, which doesn't block readers.
+"""
+from django.db import connection, transaction
+
+from .models import SpecialityStats
+
+# pg_try_advisory_xact_lock key, so overlapping scheduled runs don't stack up
+REFRESH_LOCK_ID = 0x5ec1a1
+
+
+def refresh(concurrently=True):
+    """Return False without refreshing when another refresh is running."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)', [REFRESH_LOCK_ID])
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute('REFRESH MATERIALIZED VIEW %s%s' % (
+            'CONCURRENTLY ' if concurrently else '',
+            connection.ops.quote_name(SpecialityStats._meta.db_table),
+        ))
+        return True
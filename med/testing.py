@@ -0,0 +1,41 @@
+"""Fixtures shared by the test suites of med and drf."""
+import shutil
+import tempfile
+
+from django.test import override_settings
+
+from .models import Consultation, Doctor, Speciality, User
+
+
+class TempMediaRootMixin:
+    """Points MEDIA_ROOT at a temporary directory for the whole test class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        media_settings.enable()
+        cls.addClassCleanup(media_settings.disable)
+        super().setUpClass()
+
+
+def create_user(username, **fields):
+    return User.objects.create(username=username, email='%s@example.com' % username, **fields)
+
+
+def create_doctor(user, speciality, **fields):
+    fields = {'first_name': 'Doctor', 'last_name': 'Who', 'surname': '', 'description': '', **fields}
+    return Doctor.objects.create(user=user, speciality=speciality, **fields)
+
+
+class ConsultationTestData:
+    """A patient and a doctor with one consultation between them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.speciality = Speciality.objects.create(name='Therapy')
+        cls.patient = create_user('patient')
+        cls.doctor = create_doctor(create_user('doctor'), cls.speciality)
+        cls.consultation = Consultation.objects.create(from_doctor=cls.doctor, to_user=cls.patient)
@@ -1,3 +1,282 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import admin, erasure, rollups, speciality_stats
+from .models import (
+    Consultation,
+    ConsultationMessage,
+    ConsultationStats,
+    Doctor,
+    DoctorDailyStats,
+    Review,
+    RollupWatermark,
+    Speciality,
+    User,
+)
+from .testing import ConsultationTestData, TempMediaRootMixin, create_doctor, create_user
+
+
+@override_settings(ANALYTICS_ROLLUP_ON_WRITE=False, ANALYTICS_ROLLUP_SAFETY_LAG=0)
+class RollupTests(ConsultationTestData, TestCase):
+    def message(self, **kwargs):
+        return ConsultationMessage.objects.create(
+            from_user=self.patient, consultation=self.consultation, message='Hello', attachments=[], **kwargs,
+        )
+
+    def today(self):
+        return DoctorDailyStats.objects.get(doctor=self.doctor, day=timezone.localdate())
+
+    def test_catch_up_folds_new_rows_once(self):
+        self.message()
+        self.message()
+        Review.objects.create(from_user=self.patient, to_doctor=self.doctor, rate=4, message='', consultation=self.consultation)
+
+        self.assertEqual(rollups.catch_up(), {'consultation': 1, 'message': 2, 'review': 1})
+        stats = self.today()
+        self.assertEqual((stats.consultations, stats.messages, stats.reviews, stats.rating_sum), (1, 2, 1, 4))
+        self.assertEqual(ConsultationStats.objects.get(consultation=self.consultation).messages, 2)
+        self.assertEqual(
+            RollupWatermark.objects.get(source='message').last_id,
+            ConsultationMessage.objects.latest('id').id,
+        )
+
+        self.assertEqual(rollups.catch_up(), {'consultation': 0, 'message': 0, 'review': 0})
+        self.assertEqual(self.today().messages, 2)
+
+        last = self.message()
+        rollups.catch_up()
+        self.assertEqual(self.today().messages, 3)
+        consultation_stats = ConsultationStats.objects.get(consultation=self.consultation)
+        self.assertEqual(consultation_stats.messages, 3)
+        self.assertEqual(consultation_stats.last_message_at, last.date_created)
+
+    def test_batches(self):
+        for _ in range(5):
+            self.message()
+        self.assertEqual(rollups.fold(batch_size=2)['message'], 2)
+
+        progress = []
+        totals = rollups.catch_up(batch_size=2, progress=lambda totals: progress.append(totals['message']))
+        self.assertEqual(totals['message'], 3)
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual(self.today().messages, 5)
+
+    @override_settings(ANALYTICS_ROLLUP_SAFETY_LAG=60)
+    def test_recent_rows_wait_for_safety_lag(self):
+        settled, recent, later = self.message(), self.message(), self.message()
+        Consultation.objects.update(date_created=timezone.now() - timedelta(minutes=2))
+        ConsultationMessage.objects.filter(pk__in=[settled.pk, later.pk]).update(
+            date_created=timezone.now() - timedelta(minutes=2),
+        )
+
+        # `later` is old enough, but the watermark must not move past `recent`
+        self.assertEqual(rollups.catch_up()['message'], 1)
+        self.assertEqual(RollupWatermark.objects.get(source='message').last_id, settled.id)
+
+        ConsultationMessage.objects.filter(pk=recent.pk).update(date_created=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(rollups.catch_up()['message'], 2)
+        self.assertEqual(self.today().messages, 3)
+
+    def test_rebuild_counts_rows_below_the_watermark(self):
+        self.message()
+        rollups.catch_up()
+        # committed after a higher id had already been folded
+        late = self.message()
+        RollupWatermark.objects.filter(source='message').update(last_id=late.id)
+        self.assertEqual(rollups.catch_up()['message'], 0)
+        self.assertEqual(self.today().messages, 1)
+
+        day = timezone.localdate()
+        self.assertEqual(rollups.rebuild(day, day), 1)
+        self.assertEqual(self.today().messages, 2)
+        self.assertEqual(ConsultationStats.objects.get(consultation=self.consultation).messages, 2)
+
+        # rows above the watermark are left to catch_up
+        self.message()
+        rollups.rebuild(day, day)
+        self.assertEqual(self.today().messages, 2)
+        rollups.catch_up()
+        self.assertEqual(self.today().messages, 3)
+
+    def test_discount(self):
+        self.message()
+        self.message()
+        Review.objects.create(from_user=self.patient, to_doctor=self.doctor, rate=4, message='', consultation=self.consultation)
+        rollups.catch_up()
+        unfolded = self.message()
+
+        with transaction.atomic():
+            rollups.discount(ConsultationMessage.objects.all())
+            rollups.discount(Review.objects.all())
+        stats = self.today()
+        # the unfolded message was never counted, so it isn't taken out either
+        self.assertEqual((stats.consultations, stats.messages, stats.reviews, stats.rating_sum), (1, 0, 0, 0))
+        self.assertEqual(ConsultationStats.objects.get(consultation=self.consultation).messages, 0)
+        self.assertTrue(ConsultationMessage.objects.filter(pk=unfolded.pk).exists())
+
+    @override_settings(ANALYTICS_ROLLUP_ON_WRITE=True)
+    def test_fold_on_write_is_bounded(self):
+        ConsultationMessage.objects.bulk_create([
+            ConsultationMessage(from_user=self.patient, consultation=self.consultation, message='Hello', attachments=[])
+            for _ in range(rollups.ON_WRITE_BATCH_SIZE + 10)
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.message()
+        self.assertEqual(self.today().messages, rollups.ON_WRITE_BATCH_SIZE)
+
+
+@override_settings(ANALYTICS_ROLLUP_ON_WRITE=False, ANALYTICS_ROLLUP_SAFETY_LAG=0)
+class ErasureTests(TempMediaRootMixin, TestCase):
+    """
+    ``user`` is a doctor with patients and a patient of ``other_doctor``.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        speciality = Speciality.objects.create(name='Therapy')
+        cls.user = create_user('user', first_name='Jane', last_name='Doe', avatar='users/user.png')
+        cls.patient = create_user('patient')
+        cls.doctor = create_doctor(cls.user, speciality, first_name='Jane', last_name='Doe', description='Therapist')
+        cls.other_doctor = create_doctor(create_user('other'), speciality, first_name='John', last_name='Smith')
+
+        treated = [Consultation.objects.create(from_doctor=cls.doctor, to_user=cls.patient) for _ in range(3)]
+        cls.as_patient = Consultation.objects.create(from_doctor=cls.other_doctor, to_user=cls.user)
+        cls.unrelated = Consultation.objects.create(from_doctor=cls.other_doctor, to_user=cls.patient)
+        for consultation in treated:
+            ConsultationMessage.objects.create(from_user=cls.patient, consultation=consultation, message='Hi', attachments=[])
+            ConsultationMessage.objects.create(from_user=cls.user, consultation=consultation, message='Hello', attachments=[])
+            Review.objects.create(from_user=cls.patient, to_doctor=cls.doctor, rate=5, message='Great', consultation=consultation)
+        ConsultationMessage.objects.create(
+            from_user=cls.user, consultation=cls.as_patient, message='My symptoms', attachments=['message_images/user.png'],
+        )
+        ConsultationMessage.objects.create(from_user=cls.patient, consultation=cls.unrelated, message='Hi', attachments=[])
+        Review.objects.create(from_user=cls.user, to_doctor=cls.other_doctor, rate=3, message='Fine', consultation=cls.as_patient)
+        rollups.catch_up()
+        Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        for name in ('users/user.png', 'message_images/user.png'):
+            default_storage.save(name, ContentFile(b'\x89PNG'))
+            self.addCleanup(default_storage.delete, name)
+
+    def erase(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return erasure.erase_user(self.user, **kwargs)
+
+    def assertNoHistory(self, user_id, doctor_id):
+        self.assertFalse(Consultation.objects.filter(from_doctor_id=doctor_id).exists())
+        self.assertFalse(Consultation.objects.filter(to_user_id=user_id).exists())
+        self.assertFalse(ConsultationMessage.objects.filter(from_user_id=user_id).exists())
+        self.assertFalse(Review.objects.filter(from_user_id=user_id).exists())
+        self.assertFalse(Review.objects.filter(to_doctor_id=doctor_id).exists())
+        self.assertFalse(DoctorDailyStats.objects.filter(doctor_id=doctor_id).exists())
+        self.assertFalse(ConsultationStats.objects.exclude(consultation__in=Consultation.objects.all()).exists())
+        self.assertFalse(ConsultationMessage.objects.exclude(consultation__in=Consultation.objects.all()).exists())
+        self.assertFalse(Review.objects.exclude(consultation__in=Consultation.objects.all()).exclude(consultation=None).exists())
+
+    def test_erase_user(self):
+        labels = [label for label, _, _ in erasure.user_plan(self.user)]
+        progress = []
+        counts = self.erase(chunk_size=2, progress=lambda label, done, total: progress.append((label, done, total)))
+
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Doctor.objects.filter(pk=self.doctor.pk).exists())
+        self.assertNoHistory(self.user.pk, self.doctor.pk)
+        self.assertFalse(Token.objects.filter(user_id=self.user.pk).exists())
+        # other people's consultations with each other are kept
+        self.assertEqual(list(Consultation.objects.all()), [self.unrelated])
+        self.assertEqual(ConsultationMessage.objects.get().consultation, self.unrelated)
+        self.assertTrue(DoctorDailyStats.objects.filter(doctor=self.other_doctor).exists())
+        self.assertFalse(default_storage.exists('users/user.png'))
+        self.assertFalse(default_storage.exists('message_images/user.png'))
+
+        # children before parents, in chunks of two
+        self.assertEqual(list(dict.fromkeys(label for label, _, _ in progress)), labels)
+        self.assertEqual(
+            [(done, total) for label, done, total in progress if label == 'doctor consultation messages'],
+            [(0, 6), (2, 6), (4, 6), (6, 6)],
+        )
+        self.assertEqual(counts['doctor consultations'], 3)
+        self.assertEqual(counts['patient consultations'], 1)
+        self.assertEqual(counts['user'], 1)
+
+    def test_erase_user_updates_other_doctors_rollups(self):
+        self.erase()
+
+        # what is left: the unrelated consultation with one message
+        expected = {'consultations': 1, 'messages': 1, 'reviews': 0, 'rating_sum': 0}
+        stats = DoctorDailyStats.objects.filter(doctor=self.other_doctor).values(*expected).get()
+        self.assertEqual(stats, expected)
+        day = timezone.localdate()
+        rollups.rebuild(day, day)
+        self.assertEqual(DoctorDailyStats.objects.filter(doctor=self.other_doctor).values(*expected).get(), expected)
+        self.assertEqual(ConsultationStats.objects.get().messages, 1)
+
+    def test_anonymize_user(self):
+        self.erase(anonymize=True)
+
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.username, user.email), ('deleted-%d' % user.pk, 'deleted-%d@invalid' % user.pk))
+        self.assertEqual((user.first_name, user.last_name), ('', ''))
+        self.assertFalse(user.avatar)
+        self.assertFalse(user.is_active)
+        self.assertFalse(user.has_usable_password())
+        self.assertFalse(Token.objects.filter(user=user).exists())
+        doctor = Doctor.objects.get(pk=self.doctor.pk)
+        self.assertEqual((doctor.first_name, doctor.last_name, doctor.description), ('', '', ''))
+
+        # consultations and ratings stay, what the user wrote doesn't
+        self.assertEqual(Consultation.objects.count(), 5)
+        self.assertEqual(Review.objects.filter(to_doctor=self.doctor).count(), 3)
+        self.assertEqual(
+            list(ConsultationMessage.objects.filter(from_user=user).values_list('message', 'attachments')), [('', [])] * 4,
+        )
+        self.assertEqual(Review.objects.get(from_user=user).message, '')
+        self.assertFalse(default_storage.exists('users/user.png'))
+        self.assertFalse(default_storage.exists('message_images/user.png'))
+
+    def test_erase_doctor(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            erasure.erase_doctor(self.doctor, chunk_size=2)
+
+        self.assertFalse(Doctor.objects.filter(pk=self.doctor.pk).exists())
+        self.assertFalse(Consultation.objects.filter(from_doctor_id=self.doctor.pk).exists())
+        self.assertFalse(DoctorDailyStats.objects.filter(doctor_id=self.doctor.pk).exists())
+        # the account and its patient history are kept
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(ConsultationMessage.objects.filter(consultation=self.as_patient).count(), 1)
+        self.assertTrue(default_storage.exists('message_images/user.png'))
+
+    def test_admin_action_refuses_large_selections(self):
+        admin_user = User.objects.create_superuser(username='admin', email='admin@example.com', password='secret')
+        self.client.force_login(admin_user)
+        data = {'action': 'erase_user_delete', '_selected_action': [self.user.pk]}
+
+        with mock.patch.object(admin, 'ADMIN_ERASURE_MAX_ROWS', 5):
+            response = self.client.post('/admin/med/user/', data, follow=True)
+        self.assertContains(response, 'manage.py erase_user')
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/med/user/', data)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+
+
+class SpecialityStatsTests(TestCase):
+    def test_refresh_skips_while_another_runs(self):
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [speciality_stats.REFRESH_LOCK_ID])
+        self.assertFalse(speciality_stats.refresh())
+
+        with other.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [speciality_stats.REFRESH_LOCK_ID])
+        self.assertTrue(speciality_stats.refresh())